@@ -1,19 +1,31 @@
 import os
+import ssl
+import hmac
+import hashlib
+import secrets
+import time
 from uuid import uuid4
-from datetime import datetime
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from functools import lru_cache
 
 from fastapi import FastAPI, HTTPException, Depends, Query
-from fastapi.responses import HTMLResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, Response
 from sqlalchemy import (
-    create_engine, Column, String, CHAR, DateTime, BigInteger,ForeignKey,Integer 
+    and_, func, insert, select, update, Column, String, CHAR, DateTime, BigInteger,ForeignKey,Integer 
 )
-from sqlalchemy.orm import sessionmaker, declarative_base, Session, relationship
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import declarative_base, relationship, joinedload, raiseload
 from dotenv import load_dotenv
+from jinja2 import BaseLoader, Environment
 from fastapi import Request
-from pydantic import BaseModel
-from pydantic import BaseModel, constr, Field
-from typing import Literal, Optional
-import qrcode,io,base64
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints
+from typing import Annotated, Optional
+import msgpack
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
 
 if os.path.exists(".env"):
     load_dotenv()
@@ -25,31 +37,77 @@ DB_USER    = os.getenv("DB_USER")
 DB_PASS    = os.getenv("DB_PASSWORD")
 DB_SSL_CA  = os.getenv("DB_SSL_CA")
 
+# Cada worker tiene su propio pool: DB_MAX_CONNECTIONS es el total para todos los
+# workers (WEB_CONCURRENCY, lo exporta startup.sh) y se reparte entre ellos.
+WEB_CONCURRENCY    = int(os.getenv("WEB_CONCURRENCY", "1"))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "100"))
+DB_POOL_SIZE     = int(os.getenv(
+    "DB_POOL_SIZE", str(min(20, max(2, DB_MAX_CONNECTIONS // WEB_CONCURRENCY)))
+))
+DB_MAX_OVERFLOW  = int(os.getenv("DB_MAX_OVERFLOW", "0"))
+DB_POOL_TIMEOUT  = int(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE  = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Acotar consultas lentas: conexión (TCP+TLS) y espera de cada respuesta, en segundos
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+DB_READ_TIMEOUT    = int(os.getenv("DB_READ_TIMEOUT", "15"))
+# SQLALCHEMY_ECHO=1 registra cada sentencia: sirve para contar round-trips por endpoint
+SQLALCHEMY_ECHO    = os.getenv("SQLALCHEMY_ECHO", "").lower() in ("1", "true")
+
+# Clave HMAC para tokenizar el PAN: la tabla card no guarda el número de tarjeta.
+# Es obligatoria: con otra clave (o vacía) ningún token coincidiría con los guardados.
+CARD_PAN_KEY = os.getenv("CARD_PAN_KEY")
+if not CARD_PAN_KEY:
+    raise RuntimeError("CARD_PAN_KEY no está definida: no se pueden tokenizar tarjetas")
+
+# Redis es opcional: sin REDIS_URL las lecturas van directo a MySQL
+REDIS_URL  = os.getenv("REDIS_URL")
+# Un Redis inalcanzable no debe frenar las requests: timeouts cortos, en segundos
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "0.2"))
+
 DATABASE_URL = (
-    f"mysql+pymysql://{DB_USER}:{DB_PASS}"
+    f"mysql+asyncmy://{DB_USER}:{DB_PASS}"
     f"@{DB_HOST}/{DB_NAME}?charset=utf8mb4"
 )
 
-engine = create_engine(
+# asyncmy espera un SSLContext, no el dict {"ca": ...} de pymysql
+engine = create_async_engine(
     DATABASE_URL,
-    connect_args={"ssl": {"ca": DB_SSL_CA}}
+    connect_args={
+        "ssl": ssl.create_default_context(cafile=DB_SSL_CA),
+        "connect_timeout": DB_CONNECT_TIMEOUT,
+        "read_timeout": DB_READ_TIMEOUT,
+    },
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    # Azure MySQL corta conexiones inactivas: reciclar y verificar antes de usar
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True,
+    echo=SQLALCHEMY_ECHO,
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# fábrica de sesiones: cada request obtiene su propia AsyncSession vía get_db
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 # ─── Models ────────────────────────────────────────────────────────────────────
 
 
+def pan_token(pan: str) -> str:
+    """Token determinista del PAN (ignora espacios y guiones) para buscar la tarjeta."""
+    digits = pan.replace(" ", "").replace("-", "")
+    return hmac.new(CARD_PAN_KEY.encode(), digits.encode(), hashlib.sha256).hexdigest()
+
+
 class Transaction(Base):
     __tablename__ = "transaction_"
 
     id              = Column(CHAR(36), primary_key=True)
-    created_at      = Column(DateTime, nullable=False, default=datetime.utcnow)
+    created_at      = Column(DateTime, nullable=False, server_default=func.now())
     type            = Column(String(32), nullable=False)    # 'TRANSFER','CARD_PAYMENT',...
     currency        = Column(CHAR(3), nullable=False)
     amount_minor    = Column(BigInteger, nullable=False)
-    from_account_id = Column(CHAR(36), nullable=True)
-    to_account_id   = Column(CHAR(36), nullable=True)
+    from_account_id = Column(CHAR(36), nullable=True, index=True)
+    to_account_id   = Column(CHAR(36), nullable=True, index=True)
     status          = Column(String(16), nullable=False)    # 'POSTED','FAILED',...
     ref_external    = Column(String(64), nullable=True)
     message         = Column(String(255), nullable=True)
@@ -60,14 +118,14 @@ class Card(Base):
 
     id          = Column(CHAR(36), primary_key=True)
     party_id    = Column(CHAR(36), nullable=False)
-    account_id  = Column(CHAR(36), nullable=False)
+    account_id  = Column(CHAR(36), nullable=False, index=True)
     brand       = Column(String(16), nullable=False)
-    pan         = Column(String(32), nullable=False)
+    pan_token   = Column(CHAR(64), nullable=False, unique=True, index=True)  # HMAC-SHA256 del PAN
     pan_last4   = Column(CHAR(4), nullable=False)
     exp_month   = Column(Integer, nullable=False)
     exp_year    = Column(Integer, nullable=False)
     status      = Column(String(16), nullable=False, default="ACTIVE")
-    created_at  = Column(DateTime, default=datetime.utcnow)
+    created_at  = Column(DateTime, server_default=func.now())
 
 
 class Account(Base):
@@ -78,7 +136,7 @@ class Account(Base):
     currency      = Column(CHAR(3), nullable=False)
     status        = Column(String(16), nullable=False, default="ACTIVE")
     balance_minor = Column(BigInteger, nullable=False, default=0)
-    created_at    = Column(DateTime, default=datetime.utcnow)
+    created_at    = Column(DateTime, server_default=func.now())
 
     party = relationship("Party", back_populates="accounts")
 
@@ -86,13 +144,13 @@ class Account(Base):
 class PaymentIntent(Base):
     __tablename__ = 'payment_intent'
     id            = Column(CHAR(36), primary_key=True)
-    account_id    = Column(CHAR(36), nullable=False)
+    account_id    = Column(CHAR(36), nullable=False, index=True)
     amount_minor  = Column(BigInteger, nullable=False)
     currency      = Column(CHAR(3), nullable=False, default="DOP")
     status        = Column(String(32), nullable=False, default="REQUIRES_PAYMENT")
     description   = Column(String(255))
-    created_at    = Column(DateTime, default=datetime.utcnow)
-    updated_at    = Column(DateTime, onupdate=datetime.utcnow)
+    created_at    = Column(DateTime, server_default=func.now())
+    updated_at    = Column(DateTime, onupdate=func.now())
 
 
 class Party(Base):
@@ -104,17 +162,28 @@ class Party(Base):
 
 
 # --- Schemas Pydantic ---
+AccountNo   = Annotated[str, StringConstraints(min_length=1, max_length=32)]
+CardNumber  = Annotated[str, StringConstraints(min_length=12, max_length=19)]
+AmountMinor = Annotated[int, Field(gt=0)]
+
 class PaymentIntentCreate(BaseModel):
-    account_no: constr(min_length=1, max_length=32)
-    amount_minor: int = Field(gt=0)
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    account_no: AccountNo
+    amount_minor: AmountMinor
     description: Optional[str]
 
 class PaymentIntentOut(BaseModel):
+    # se devuelve la PaymentIntent del ORM tal cual; pydantic lee los atributos
+    model_config = ConfigDict(from_attributes=True)
+
     id: str
     status: str
 
 class ConfirmPayment(BaseModel):
-    card_number: constr(min_length=12, max_length=19)
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    card_number: CardNumber
     exp_month: int
     exp_year: int
 
@@ -123,21 +192,152 @@ class Paylink(Base):
     __tablename__ = "paylink"
     id                = Column(CHAR(36), primary_key=True)
     account_id        = Column(CHAR(36), nullable=False)
-    payment_intent_id = Column(CHAR(36), nullable=True)
+    payment_intent_id = Column(CHAR(36), nullable=True, index=True)
     kind              = Column(String(8), nullable=False)    # "URL" or "QR"
     slug              = Column(String(64), unique=True, nullable=False)
     expires_at        = Column(DateTime, nullable=True)
-    created_at        = Column(DateTime, default=datetime.utcnow)
+    created_at        = Column(DateTime, server_default=func.now())
 
 # ─── App & Dependencies ───────────────────────────────────────────────────────
-app = FastAPI(title="Portal de Pago")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # confirm_payment bloquea solo la intención con FOR UPDATE OF, que requiere
+    # MySQL 8.0+. En 5.7 SQLAlchemy emite un FOR UPDATE simple que bloquea también
+    # cuenta y tarjeta: mejor no arrancar que serializar pagos sin avisar.
+    async with engine.connect():
+        pass    # la primera conexión inicializa el dialecto con la versión del server
+    if not engine.dialect.supports_for_update_of:
+        version = ".".join(map(str, engine.dialect.server_version_info or ()))
+        raise RuntimeError(f"Se requiere MySQL 8.0+ (FOR UPDATE OF), el servidor es {version}")
+    yield
+
+
+app = FastAPI(title="Portal de Pago", lifespan=lifespan)
+
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
+
+
+# Códigos MySQL: 1213 deadlock, 1205 lock wait timeout
+LOCK_CONFLICT_ERRORS = {1213, 1205}
+
+
+def is_lock_conflict(exc: OperationalError) -> bool:
+    """True si MySQL abortó la transacción por deadlock o espera de lock."""
+    args = getattr(exc.orig, "args", ())
+    return bool(args) and args[0] in LOCK_CONFLICT_ERRORS
+
+
+# ─── Cache ─────────────────────────────────────────────────────────────────────
+redis_client = (
+    Redis.from_url(
+        REDIS_URL,
+        socket_timeout=REDIS_TIMEOUT,
+        socket_connect_timeout=REDIS_TIMEOUT,
+    )
+    if REDIS_URL else None
+)
+
+PAYLINK_TTL_MIN = 5       # segundos
+PAYLINK_TTL_MAX = 1800
+ACCOUNT_TTL     = 3600
+
 
-def get_db():
-    db = SessionLocal()
+async def cache_get(key: str) -> Optional[dict]:
+    """Lee un blob msgpack de Redis; sin Redis, con Redis caído o con un blob
+    corrupto devuelve None (miss)."""
+    if redis_client is None:
+        return None
     try:
-        yield db
-    finally:
-        db.close()
+        cached = await redis_client.get(key)
+    except RedisError:
+        return None
+    if cached is None:
+        return None
+    try:
+        value = msgpack.unpackb(cached)
+    except (ValueError, msgpack.UnpackException):
+        return None
+    return value if isinstance(value, dict) else None
+
+
+async def cache_set(key: str, value: dict, ttl: int) -> None:
+    """Guarda un blob msgpack con TTL en segundos; los errores de Redis se ignoran."""
+    if redis_client is None:
+        return
+    try:
+        await redis_client.set(key, msgpack.packb(value), px=ttl * 1000)
+    except RedisError:
+        pass
+
+
+def paylink_ttl(expires_at: Optional[datetime], now: datetime) -> int:
+    """TTL en segundos del paylink cacheado: hasta que expire, acotado."""
+    if expires_at is None:
+        return PAYLINK_TTL_MAX
+    ttl = int((expires_at - now).total_seconds())
+    return max(PAYLINK_TTL_MIN, min(ttl, PAYLINK_TTL_MAX))
+
+
+async def load_paylink_view(db: AsyncSession, code: str) -> Optional[dict]:
+    """Datos que necesita el portal de pago para un slug (read-through en Redis).
+
+    Devuelve None si el link no existe. Un Redis caído no rompe el portal:
+    simplemente se consulta MySQL.
+    """
+    key = f"paylink:{code}"
+    cached = await cache_get(key)
+    if cached is not None:
+        return cached
+
+    link = await db.scalar(select(Paylink).where(Paylink.slug == code))
+    if not link:
+        return None
+    # cuenta + titular en un solo JOIN; raiseload hace fallar cualquier lazy-load futuro
+    cuenta = await db.scalar(
+        select(Account)
+        .options(joinedload(Account.party), raiseload("*"))
+        .where(Account.id == link.account_id)
+    )
+    if not cuenta:
+        raise HTTPException(404, "Cuenta destino no encontrada")
+
+    view = {
+        "account_id": cuenta.id,
+        "account_no": cuenta.account_no,
+        "currency":   cuenta.currency,
+        "full_name":  cuenta.party.full_name,
+        "expires_ts": (
+            int(link.expires_at.replace(tzinfo=timezone.utc).timestamp())
+            if link.expires_at else None
+        ),
+    }
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    await cache_set(key, view, paylink_ttl(link.expires_at, now))
+    return view
+
+
+async def fetch_account_by_no(db: AsyncSession, account_no: str) -> Optional[dict]:
+    """id, moneda y titular de una cuenta por número (cache-aside en Redis).
+
+    Solo se cachean datos que no cambian; el saldo siempre se lee/escribe en MySQL,
+    así que los UPDATE de balance no necesitan invalidar esta entrada.
+    """
+    key = f"acct:{account_no}"
+    cached = await cache_get(key)
+    if cached is not None:
+        return cached
+
+    row = (await db.execute(
+        select(Account.id, Account.currency, Account.party_id)
+        .where(Account.account_no == account_no)
+    )).first()
+    if not row:
+        return None
+    acct = {"id": row.id, "currency": row.currency, "party_id": row.party_id}
+    await cache_set(key, acct, ACCOUNT_TTL)
+    return acct
 
 
 # --- Schema de salida ---
@@ -145,109 +345,159 @@ class PaymentLinkResponse(BaseModel):
     slug: str
     url: str
 
-@app.get("/health")
-def health():
-    # chequeo mínimo: la app está viva
-    return {"status": "ok"}
+class HealthOut(BaseModel):
+    status: str
 
-@app.get("/health")
-def health():
+@app.get("/health", response_model=HealthOut)
+async def health():
     # chequeo mínimo: la app está viva
     return {"status": "ok"}
 
 
 @app.post("/payment-intents", response_model=PaymentIntentOut, status_code=201)
-def create_payment_intent(data: PaymentIntentCreate, db: Session = Depends(get_db)):
-    acct = db.query(Account).filter_by(account_no=data.account_no).first()
+async def create_payment_intent(data: PaymentIntentCreate, db: AsyncSession = Depends(get_db)):
+    acct = await fetch_account_by_no(db, data.account_no)
     if not acct:
         raise HTTPException(404, "Cuenta no encontrada")
-    currency = acct.currency
+    currency = acct["currency"]
     pi = PaymentIntent(
         id=str(uuid4()),
-        account_id=acct.id,
+        account_id=acct["id"],
         amount_minor=data.amount_minor,
         currency=currency,
         status="REQUIRES_PAYMENT",
         description=data.description
     )
-    db.add(pi); db.commit()
-    return {"id": pi.id, "status": pi.status}
+    db.add(pi); await db.commit()
+    return pi
 
 # --- Endpoint: confirmar cobro con tarjeta ---
 @app.post("/payment-intents/{pi_id}/confirm", response_model=PaymentIntentOut)
-def confirm_payment(pi_id: str, data: ConfirmPayment, db: Session = Depends(get_db)):
-    pi = db.query(PaymentIntent).get(pi_id)
-    if not pi:
-        raise HTTPException(404, "Intentión no encontrada")
-    if pi.status != "REQUIRES_PAYMENT":
-        return {"id": pi.id, "status": pi.status}
-
-    # 1) Validar tarjeta (ej. tabla Card)
-    card = db.query(Card).filter_by(
-        pan=data.card_number,
-        exp_month=data.exp_month,
-        exp_year=data.exp_year,
-        status="ACTIVE"
-    ).first()
-    if not card:
-        pi.status = "FAILED"; db.commit()
-        raise HTTPException(422, "Tarjeta declinada")
-
-    # 2) Debitar y acreditar atómicamente
-    from_account = db.query(Account).get(card.account_id)
-    to_account   = db.query(Account).get(pi.account_id)
-    if from_account.balance_minor < pi.amount_minor:
-        pi.status = "FAILED"; db.commit()
-        raise HTTPException(422, "Fondos insuficientes")
-
-    # 3) Ajustar saldos y crear transacción
-    from_account.balance_minor -= pi.amount_minor
-    to_account.balance_minor   += pi.amount_minor
-    tx = Transaction(
-        id=str(uuid4()),
-        type="CARD_PAYMENT",
-        currency=pi.currency,
-        amount_minor=pi.amount_minor,
-        from_account_id=from_account.id,
-        to_account_id=to_account.id,
-        status="POSTED",
-        created_at=datetime.utcnow()
-    )
-    pi.status = "CAPTURED"
-    db.add(tx)
-    db.commit()
-
-    return {"id": pi.id, "status": pi.status}
+async def confirm_payment(pi_id: str, data: ConfirmPayment, db: AsyncSession = Depends(get_db)):
+    try:
+        # intención + cuenta destino + tarjeta en un solo round-trip. Lock de fila
+        # solo sobre la intención: dos confirmaciones concurrentes no pueden pasar
+        # ambas el chequeo de status. Las cuentas no se bloquean aquí (el abono es un
+        # UPDATE atómico); así no se serializan todos los pagos a un mismo comercio.
+        # La tarjeta (pan_token es único) va en LEFT JOIN: si no coincide, card es None.
+        row = (await db.execute(
+            select(PaymentIntent, Account, Card)
+            .join(Account, Account.id == PaymentIntent.account_id)
+            .outerjoin(Card, and_(
+                Card.pan_token == pan_token(data.card_number),
+                Card.exp_month == data.exp_month,
+                Card.exp_year == data.exp_year,
+                Card.status == "ACTIVE"
+            ))
+            .where(PaymentIntent.id == pi_id)
+            .with_for_update(of=PaymentIntent)
+        )).first()
+        if not row:
+            raise HTTPException(404, "Intentión no encontrada")
+        pi, to_account, card = row
+        if pi.status != "REQUIRES_PAYMENT":
+            return pi
+
+        # 1) Validar tarjeta
+        if not card:
+            pi.status = "FAILED"; await db.commit()
+            raise HTTPException(422, "Tarjeta declinada")
+
+        # 2) Mover saldos con UPDATEs atómicos (el WHERE del débito hace el chequeo
+        #    de saldo). Las cuentas se actualizan en orden ascendente de id: dos pagos
+        #    cruzados (A➔B y B➔A) toman los locks en el mismo orden y no se bloquean.
+        amount = pi.amount_minor
+        movements = sorted(
+            [(card.account_id, -amount), (to_account.id, amount)],
+            key=lambda m: m[0],   # sort estable: con la misma cuenta, débito primero
+        )
+        for account_id, delta in movements:
+            stmt = update(Account).where(Account.id == account_id)
+            if delta < 0:
+                stmt = stmt.where(Account.balance_minor >= amount)
+            result = await db.execute(
+                stmt.values(balance_minor=Account.balance_minor + delta)
+                .execution_options(synchronize_session=False)
+            )
+            if delta < 0 and result.rowcount != 1:
+                # el abono pudo haberse aplicado ya: deshacerlo antes de marcar FAILED
+                await db.rollback()
+                await db.execute(
+                    update(PaymentIntent)
+                    .where(PaymentIntent.id == pi_id, PaymentIntent.status == "REQUIRES_PAYMENT")
+                    .values(status="FAILED")
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+                raise HTTPException(422, "Fondos insuficientes")
+
+        # 3) Crear transacción
+        tx = Transaction(
+            id=str(uuid4()),
+            type="CARD_PAYMENT",
+            currency=pi.currency,
+            amount_minor=amount,
+            from_account_id=card.account_id,
+            to_account_id=to_account.id,
+            status="POSTED"
+        )
+        pi.status = "CAPTURED"
+        db.add(tx)
+        await db.commit()
+    except OperationalError as e:
+        if not is_lock_conflict(e):
+            raise
+        # Con 1213 MySQL deshace toda la transacción, pero con 1205 (y el default
+        # innodb_rollback_on_timeout=OFF) solo la sentencia: el rollback explícito
+        # descarta lo aplicado y deja la intención en REQUIRES_PAYMENT.
+        await db.rollback()
+        raise HTTPException(409, "Conflicto con otro pago en curso, reintente")
+
+    return pi
 
 
 # --- Endpoint: crear y devolver link de pago para una cuenta ---
+SLUG_ATTEMPTS = 3
+
+
+def new_slug() -> str:
+    """Slug corto y URL-safe: 6 bytes aleatorios ➔ 8 caracteres (48 bits)."""
+    return "pl-" + secrets.token_urlsafe(6)
+
+
 @app.post(
     "/accounts/{account_no}/payment-link",
     response_model=PaymentLinkResponse,
     status_code=201
 )
-def create_payment_link(
+async def create_payment_link(
     account_no: str,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # 1) Verificar que la cuenta existe
-    cuenta = db.query(Account).filter_by(account_no=account_no).first()
+    cuenta = await fetch_account_by_no(db, account_no)
     if not cuenta:
         raise HTTPException(status_code=404, detail="Cuenta no encontrada")
 
-    # 2) Generar slug y crear Paylink
-    slug = "pl-" + uuid4().hex[:8]
-    link = Paylink(
-        id=str(uuid4()),
-        account_id=cuenta.id,
-        payment_intent_id=None,
-        kind="URL",
-        slug=slug,
-        created_at=datetime.utcnow()
-    )
-    db.add(link)
-    db.commit()
+    # 2) Generar slug y crear Paylink (INSERT directo: no se usa el objeto ORM).
+    #    slug es UNIQUE: ante una colisión se reintenta con otro slug.
+    for attempt in range(SLUG_ATTEMPTS):
+        slug = new_slug()
+        try:
+            await db.execute(insert(Paylink).values(
+                id=str(uuid4()),
+                account_id=cuenta["id"],
+                payment_intent_id=None,
+                kind="URL",
+                slug=slug
+            ))
+            await db.commit()
+            break
+        except IntegrityError:
+            await db.rollback()
+            if attempt == SLUG_ATTEMPTS - 1:
+                raise
 
     # 3) Construir URL absoluta al portal de pago
     #    request.url_for('link_de_pago') ➔ http://host:port/link-de-pago
@@ -257,30 +507,15 @@ def create_payment_link(
     return PaymentLinkResponse(slug=slug, url=url)
 
 # ─── Endpoint: Portal de Pago ─────────────────────────────────────────────────
-@app.get("/link-de-pago", response_class=HTMLResponse)
-def link_de_pago(
-    code: str = Query(..., description="Código corto del enlace de pago"),
-    db: Session = Depends(get_db)
-):
-    link = db.query(Paylink).filter_by(slug=code).first()
-    if not link:
-        raise HTTPException(404, "Link de pago no válido")
-
-    url_pago = f"/link-de-pago?code={code}"
-    img = qrcode.make(url_pago)
-    buf = io.BytesIO(); img.save(buf, format="PNG")
-    qr_base64 = base64.b64encode(buf.getvalue()).decode()
-
-    cuenta = db.query(Account).get(link.account_id)
-    if not cuenta:
-        raise HTTPException(404, "Cuenta destino no encontrada")
-    nombre = cuenta.party.full_name
-    html = f"""
+# Plantilla precompilada una sola vez; autoescape evita inyectar HTML con
+# el nombre del titular o el código del link.
+_templates = Environment(loader=BaseLoader(), autoescape=True)
+LINK_DE_PAGO_HTML = """
     <!DOCTYPE html>
     <html>
       <head>
         <meta charset="utf-8"/>
-        <title>Pagar a {cuenta.account_no}</title>
+        <title>Pagar a {{ account_no }}</title>
         <!-- Bootstrap CDN para estilo rápido -->
         <link 
           href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" 
@@ -291,11 +526,11 @@ def link_de_pago(
         <div class="container py-5">
           <div class="card mx-auto" style="max-width: 500px;">
             <div class="card-body">
-              <h4 class="card-title mb-3">Pago a: {nombre}</h4>
-              <p class="text-muted">Cuenta destino: <strong>{cuenta.account_no}</strong></p>
+              <h4 class="card-title mb-3">Pago a: {{ nombre }}</h4>
+              <p class="text-muted">Cuenta destino: <strong>{{ account_no }}</strong></p>
               <form id="payForm">
                 <div class="mb-3">
-                  <label class="form-label">{cuenta.currency}</label>
+                  <label class="form-label">{{ currency }}</label>
                   <input 
                     type="number" id="amount" class="form-control"
                     min="0.01" step="0.01" placeholder="Ingresa monto" required
@@ -325,39 +560,98 @@ def link_de_pago(
           </div>
         </div>
         <script>
-        document.getElementById('payForm').addEventListener('submit', async e => {{
+        document.getElementById('payForm').addEventListener('submit', async e => {
           e.preventDefault();
           const amt = Math.round(parseFloat(document.getElementById('amount').value) * 100);
-          const pi = await fetch('/payment-intents', {{
-            method:'POST', headers:{{'Content-Type':'application/json'}},
-            body:JSON.stringify({{
-              account_no: "{cuenta.account_no}",
+          const pi = await fetch('/payment-intents', {
+            method:'POST', headers:{'Content-Type':'application/json'},
+            body:JSON.stringify({
+              account_no: {{ account_no|tojson }},
               amount_minor: amt,
               currency: "DOP",
-              description: "Pago via link {code}",
+              description: {{ ("Pago via link " ~ code)|tojson }},
               create_link: false
-            }})
-          }}).then(r=>r.json());
+            })
+          }).then(r=>r.json());
           if (!pi.id) return document.getElementById('resultado').innerText = JSON.stringify(pi, null,2);
-          const res = await fetch(`/payment-intents/${{pi.id}}/confirm`, {{
-            method:'POST', headers:{{'Content-Type':'application/json'}},
-            body:JSON.stringify({{
+          const res = await fetch(`/payment-intents/${pi.id}/confirm`, {
+            method:'POST', headers:{'Content-Type':'application/json'},
+            body:JSON.stringify({
               card_number: document.getElementById('card').value,
               exp_month: parseInt(document.getElementById('mm').value),
               exp_year: parseInt(document.getElementById('yy').value),
-            }})
-          }}).then(r=>r.json());
+            })
+          }).then(r=>r.json());
           document.getElementById('resultado').innerText = JSON.stringify(res, null,2);
-        }});
+        });
         </script>
 	    <div style="text-align:center;">
         <h4>Escanear el codigo QR:</h4>
-         <img src="data:image/png;base64,{qr_base64}" alt="QR de pago" width="220" height="220">
+         <div role="img" aria-label="QR de pago" style="width:220px;height:220px;margin:0 auto;">{{ qr_svg|safe }}</div>
 		</div>
       </body>
     </html>
+"""
+LINK_DE_PAGO_TPL = _templates.from_string(LINK_DE_PAGO_HTML)
+# Entra en el ETag: un deploy que cambie la plantilla invalida las copias cacheadas
+LINK_DE_PAGO_TPL_HASH = hashlib.blake2b(LINK_DE_PAGO_HTML.encode(), digest_size=8).hexdigest()
+
+
+# Caché por proceso en lugar de un qr:{slug} en Redis: el SVG sale del slug y nada
+# más, así que cada worker lo renderiza una sola vez por slug y los siguientes GET
+# no pagan ni el render ni un round-trip a Redis.
+@lru_cache(maxsize=4096)
+def qr_svg(code: str) -> str:
+    """QR del portal como SVG inline. Es determinista por slug: se genera una vez.
+
+    Se renderiza en el servidor para no cargar JS de terceros en la página donde
+    se teclea la tarjeta; el SVG (sin tamaño fijo, escala al contenedor) pesa menos
+    que el PNG en base64 y no necesita PIL.
     """
-    return HTMLResponse(html)
+    import segno    # solo la página del portal genera QR: no cargarlo al arrancar cada worker
+    qr = segno.make(f"/link-de-pago?code={code}", error="l")
+    return qr.svg_inline(border=1, omitsize=True)
+
+
+PORTAL_MAX_AGE = 300     # segundos
+PORTAL_SWR     = 60
+
+
+@app.get("/link-de-pago", response_class=HTMLResponse)
+async def link_de_pago(
+    request: Request,
+    code: str = Query(..., description="Código corto del enlace de pago"),
+    db: AsyncSession = Depends(get_db)
+):
+    view = await load_paylink_view(db, code)
+    if not view:
+        raise HTTPException(404, "Link de pago no válido")
+
+    # La página no cambia mientras el link no expire: cacheable por navegador/CDN y
+    # GET condicional ➔ 304 sin HTML. El ETag cubre los datos del link y la
+    # versión de la plantilla.
+    fingerprint = "|".join(str(view[k]) for k in ("account_no", "currency", "full_name", "expires_ts"))
+    etag_src = f"{LINK_DE_PAGO_TPL_HASH}|{code}|{fingerprint}"
+    etag = 'W/"%s"' % hashlib.blake2b(etag_src.encode(), digest_size=8).hexdigest()
+    cache_control = f"public, max-age={PORTAL_MAX_AGE}, stale-while-revalidate={PORTAL_SWR}"
+    if view["expires_ts"] is not None:
+        remaining = view["expires_ts"] - int(time.time())
+        if remaining < PORTAL_MAX_AGE + PORTAL_SWR:
+            # no servir desde caché un link ya expirado
+            cache_control = f"public, max-age={max(remaining, 0)}"
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+
+    html = LINK_DE_PAGO_TPL.render(
+        account_no=view["account_no"],
+        currency=view["currency"],
+        nombre=view["full_name"],
+        code=code,
+        qr_svg=await run_in_threadpool(qr_svg, code),
+    )
+    return HTMLResponse(html, headers=headers)
 
 
 # ─── (Aquí podrías incluir más endpoints: health-check, listado de links, etc.) ──
@@ -0,0 +1,10 @@
+-- created_at lo asigna MySQL (server_default=func.now() en los modelos):
+-- la app ya no envía la columna en los INSERT.
+-- Azure Database for MySQL usa UTC como time_zone por defecto, igual que el
+-- datetime.utcnow() que se usaba antes.
+
+ALTER TABLE transaction_   MODIFY created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE card           MODIFY created_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE account        MODIFY created_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE payment_intent MODIFY created_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE paylink        MODIFY created_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP;
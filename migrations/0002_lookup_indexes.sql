@@ -0,0 +1,9 @@
+-- Índices para las columnas por las que se filtra o se hace JOIN
+-- (index=True en los modelos; los nombres siguen la convención de SQLAlchemy).
+-- InnoDB los crea en línea, sin bloquear escrituras.
+
+CREATE INDEX ix_paylink_payment_intent_id   ON paylink (payment_intent_id)   ALGORITHM=INPLACE LOCK=NONE;
+CREATE INDEX ix_payment_intent_account_id   ON payment_intent (account_id)   ALGORITHM=INPLACE LOCK=NONE;
+CREATE INDEX ix_transaction__from_account_id ON transaction_ (from_account_id) ALGORITHM=INPLACE LOCK=NONE;
+CREATE INDEX ix_transaction__to_account_id   ON transaction_ (to_account_id)   ALGORITHM=INPLACE LOCK=NONE;
+CREATE INDEX ix_card_account_id             ON card (account_id)             ALGORITHM=INPLACE LOCK=NONE;
@@ -0,0 +1,16 @@
+-- Tokenizar el PAN: card.pan_token = HMAC-SHA256(CARD_PAN_KEY, PAN sin espacios)
+-- reemplaza a card.pan (número de tarjeta en claro y sin índice único).
+--
+-- Las tarjetas las da de alta el sistema de emisión, no este portal. Antes de
+-- ejecutar 0004 la emisión tiene que escribir pan_token (con la misma
+-- CARD_PAN_KEY) en cada alta; mientras solo escriba pan, cada tarjeta nueva queda
+-- sin token y 0004 no se puede aplicar.
+--
+-- Orden de despliegue:
+--   1) este archivo
+--   2) la emisión de tarjetas empieza a escribir pan_token
+--   3) python migrations/backfill_pan_token.py   (MySQL no tiene HMAC)
+--   4) 0004_card_pan_token_enforce.sql, justo después del backfill
+
+-- Columna nueva, nullable mientras se rellena
+ALTER TABLE card ADD COLUMN pan_token CHAR(64) NULL, ALGORITHM=INPLACE, LOCK=NONE;
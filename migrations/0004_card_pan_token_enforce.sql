@@ -0,0 +1,13 @@
+-- Se ejecuta después de migrations/backfill_pan_token.py (ver 0003), que termina
+-- fallando si todavía quedan tarjetas sin pan_token.
+
+-- NOT NULL primero: en modo estricto el MODIFY falla si apareció una tarjeta sin
+-- token después del backfill, y no se aplica nada de lo que sigue.
+SET SESSION sql_mode = CONCAT(@@SESSION.sql_mode, ',STRICT_ALL_TABLES');
+ALTER TABLE card MODIFY pan_token CHAR(64) NOT NULL;
+
+-- Índice único
+CREATE UNIQUE INDEX ix_card_pan_token ON card (pan_token) ALGORITHM=INPLACE LOCK=NONE;
+
+-- Dejar de guardar el PAN en claro
+ALTER TABLE card DROP COLUMN pan;
@@ -0,0 +1,66 @@
+"""Rellena card.pan_token a partir de card.pan (entre 0003 y 0004).
+
+Usa las mismas variables de entorno que la app (DB_*, CARD_PAN_KEY):
+
+    python migrations/backfill_pan_token.py
+
+Recorre la tabla por rangos de id, en lotes de BACKFILL_BATCH_SIZE filas con una
+transacción corta por lote, para no bloquear card ni cargar todos los PAN en
+memoria. Al final vuelve a contar las filas sin token y sale con error si queda
+alguna: 0004 solo se ejecuta después de una pasada limpia.
+
+Importar app ya falla si CARD_PAN_KEY no está definida; se vuelve a comprobar
+aquí para que nunca se escriban tokens con una clave vacía.
+"""
+import asyncio
+import os
+import sys
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import CARD_PAN_KEY, engine, pan_token  # noqa: E402
+
+BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "1000"))
+
+
+async def main():
+    if not CARD_PAN_KEY:
+        raise SystemExit("CARD_PAN_KEY no está definida: no se escriben tokens")
+    total, last_id = 0, ""
+    while True:
+        async with engine.begin() as conn:
+            rows = (await conn.execute(
+                text(
+                    "SELECT id, pan FROM card"
+                    " WHERE pan_token IS NULL AND id > :last_id"
+                    " ORDER BY id LIMIT :batch"
+                ),
+                {"last_id": last_id, "batch": BATCH_SIZE},
+            )).all()
+            if not rows:
+                break
+            # pan_token IS NULL: no pisar el token que ya escribió la emisión
+            await conn.execute(
+                text("UPDATE card SET pan_token = :token WHERE id = :id AND pan_token IS NULL"),
+                [{"id": card_id, "token": pan_token(pan)} for card_id, pan in rows],
+            )
+        total += len(rows)
+        last_id = rows[-1][0]
+        print(f"{total} tarjetas tokenizadas (hasta id {last_id})")
+
+    async with engine.connect() as conn:
+        missing = (await conn.execute(
+            text("SELECT COUNT(*) FROM card WHERE pan_token IS NULL")
+        )).scalar_one()
+    await engine.dispose()
+    if missing:
+        raise SystemExit(
+            f"{missing} tarjetas siguen sin pan_token: la emisión todavía escribe solo "
+            "pan. No ejecutar 0004; volver a correr el backfill."
+        )
+    print(f"{total} tarjetas tokenizadas, ninguna sin pan_token")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
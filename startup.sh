@@ -0,0 +1,14 @@
+#!/bin/sh
+# Comando de arranque en Azure App Service (Startup Command: sh startup.sh).
+# WEB_CONCURRENCY fija el número de workers (por defecto 2 × núcleos + 1).
+# Se exporta para que app.py reparta DB_MAX_CONNECTIONS (por defecto 100)
+# entre los pools de BD de todos los workers.
+WEB_CONCURRENCY="${WEB_CONCURRENCY:-$((2 * $(nproc) + 1))}"
+export WEB_CONCURRENCY
+
+exec uvicorn app:app \
+    --host 0.0.0.0 \
+    --port "${PORT:-8000}" \
+    --workers "$WEB_CONCURRENCY" \
+    --loop uvloop \
+    --http httptools
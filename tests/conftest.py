@@ -0,0 +1,79 @@
+import asyncio
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+# app exige CARD_PAN_KEY al importarse; Redis queda desactivado
+os.environ.setdefault("CARD_PAN_KEY", "test-key")
+os.environ.pop("REDIS_URL", None)
+
+import app  # noqa: E402
+
+PAYER_CARD = "4111111111111111"
+
+
+async def _seed(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(app.Base.metadata.create_all)
+    async with async_sessionmaker(engine)() as s:
+        s.add_all([
+            app.Party(id="p1", full_name="Comercio"),
+            app.Party(id="p2", full_name="Cliente"),
+            # a1 < a2: en un pago a2 ➔ a1 el abono se aplica antes que el débito
+            app.Account(id="a1", party_id="p1", account_no="100", currency="DOP",
+                        status="ACTIVE", balance_minor=0),
+            app.Account(id="a2", party_id="p2", account_no="200", currency="DOP",
+                        status="ACTIVE", balance_minor=5000),
+            app.Card(id="c1", party_id="p2", account_id="a2", brand="VISA",
+                     pan_token=app.pan_token(PAYER_CARD), pan_last4="1111",
+                     exp_month=12, exp_year=2030, status="ACTIVE"),
+        ])
+        await s.commit()
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    """SQLite en memoria (una sola conexión compartida) en lugar de MySQL."""
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    asyncio.run(_seed(engine))
+    monkeypatch.setattr(app, "engine", engine)
+    monkeypatch.setattr(app, "SessionLocal", async_sessionmaker(
+        engine, autoflush=False, expire_on_commit=False
+    ))
+    monkeypatch.setattr(app, "redis_client", None)
+    yield engine
+    asyncio.run(engine.dispose())
+
+
+@pytest.fixture
+def client(engine):
+    # sin "with": el lifespan exige MySQL 8 y aquí la base es SQLite
+    return TestClient(app.app)
+
+
+@pytest.fixture
+def statements(engine):
+    """Sentencias SQL enviadas al servidor (before_cursor_execute)."""
+    seen = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count)
+    yield seen
+    event.remove(engine.sync_engine, "before_cursor_execute", count)
+
+
+@pytest.fixture
+def query(engine):
+    """Lee el estado de la base fuera de la request."""
+    def run(stmt):
+        async def fetch():
+            async with engine.connect() as conn:
+                return (await conn.execute(stmt)).all()
+        return asyncio.run(fetch())
+    return run
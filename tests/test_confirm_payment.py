@@ -0,0 +1,125 @@
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import app
+from tests.conftest import PAYER_CARD
+
+
+def create_intent(client, account_no="100", amount=1000):
+    r = client.post("/payment-intents", json={
+        "account_no": account_no, "amount_minor": amount, "description": "test"
+    })
+    assert r.status_code == 201
+    return r.json()["id"]
+
+
+def confirm(client, pi_id, card=PAYER_CARD):
+    return client.post(f"/payment-intents/{pi_id}/confirm", json={
+        "card_number": card, "exp_month": 12, "exp_year": 2030
+    })
+
+
+def balances(query):
+    return dict(query(select(app.Account.id, app.Account.balance_minor)))
+
+
+def intent_status(query, pi_id):
+    return query(select(app.PaymentIntent.status).where(app.PaymentIntent.id == pi_id))[0][0]
+
+
+def transactions(query):
+    return len(query(select(app.Transaction.id)))
+
+
+def test_capture(client, query, statements):
+    pi_id = create_intent(client, amount=1000)
+    statements.clear()
+    r = confirm(client, pi_id)
+    assert r.status_code == 200 and r.json()["status"] == "CAPTURED"
+    # SELECT con lock, abono, débito, INSERT transaction, UPDATE intención
+    assert len(statements) == 5
+    assert balances(query) == {"a1": 1000, "a2": 4000}
+    assert transactions(query) == 1
+
+
+def test_already_captured_is_read_only(client, query, statements):
+    pi_id = create_intent(client, amount=1000)
+    confirm(client, pi_id)
+    statements.clear()
+    r = confirm(client, pi_id)
+    assert r.status_code == 200 and r.json()["status"] == "CAPTURED"
+    assert len(statements) == 1
+    assert balances(query) == {"a1": 1000, "a2": 4000}
+
+
+def test_declined_card(client, query, statements):
+    pi_id = create_intent(client)
+    statements.clear()
+    r = confirm(client, pi_id, card="4000000000000000")
+    assert r.status_code == 422 and r.json()["detail"] == "Tarjeta declinada"
+    assert len(statements) == 2
+    assert intent_status(query, pi_id) == "FAILED"
+    assert balances(query) == {"a1": 0, "a2": 5000}
+
+
+def test_insufficient_funds_undoes_credit(client, query, statements):
+    # a1 < a2: el abono a a1 ya se ejecutó cuando falla el débito de a2
+    pi_id = create_intent(client, amount=6000)
+    statements.clear()
+    r = confirm(client, pi_id)
+    assert r.status_code == 422 and r.json()["detail"] == "Fondos insuficientes"
+    # SELECT, abono, débito sin filas, UPDATE intención tras el rollback
+    assert len(statements) == 4
+    assert intent_status(query, pi_id) == "FAILED"
+    assert balances(query) == {"a1": 0, "a2": 5000}
+    assert transactions(query) == 0
+
+
+def test_self_payment(client, query):
+    pi_id = create_intent(client, account_no="200", amount=1000)
+    r = confirm(client, pi_id)
+    assert r.status_code == 200 and r.json()["status"] == "CAPTURED"
+    assert balances(query) == {"a1": 0, "a2": 5000}
+
+
+def test_self_payment_insufficient_funds(client, query):
+    pi_id = create_intent(client, account_no="200", amount=6000)
+    r = confirm(client, pi_id)
+    assert r.status_code == 422
+    assert intent_status(query, pi_id) == "FAILED"
+    assert balances(query) == {"a1": 0, "a2": 5000}
+
+
+def failing_statement(where):
+    """Predicado: qué sentencia de confirm_payment choca con otro pago."""
+    account_updates = 0
+
+    def fails(stmt):
+        nonlocal account_updates
+        if where == "intent_lock":
+            return stmt.is_select   # el SELECT ... FOR UPDATE sobre la intención
+        if stmt.is_update and stmt.table.name == "account":
+            account_updates += 1
+            return account_updates == 2   # el débito, con el abono ya aplicado
+        return False
+    return fails
+
+
+@pytest.mark.parametrize("where, code", [("intent_lock", 1205), ("debit", 1213)])
+def test_lock_conflict_returns_409(client, query, monkeypatch, where, code):
+    fails = failing_statement(where)
+    pi_id = create_intent(client, amount=1000)
+    execute = AsyncSession.execute
+
+    async def conflict(self, stmt, *args, **kwargs):
+        if fails(stmt):
+            raise OperationalError(str(stmt), {}, Exception(code, "lock conflict"))
+        return await execute(self, stmt, *args, **kwargs)
+
+    monkeypatch.setattr(AsyncSession, "execute", conflict)
+    r = confirm(client, pi_id)
+    assert r.status_code == 409
+    assert intent_status(query, pi_id) == "REQUIRES_PAYMENT"
+    assert balances(query) == {"a1": 0, "a2": 5000}
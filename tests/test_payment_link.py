@@ -0,0 +1,26 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+import app
+
+
+def test_slug_collision_is_retried(client, monkeypatch):
+    slugs = iter(["pl-dup", "pl-dup", "pl-new"])
+    monkeypatch.setattr(app, "new_slug", lambda: next(slugs))
+    assert client.post("/accounts/100/payment-link").json()["slug"] == "pl-dup"
+
+    r = client.post("/accounts/100/payment-link")
+    assert r.status_code == 201
+    assert r.json()["slug"] == "pl-new"
+    assert r.json()["url"].endswith("/link-de-pago?code=pl-new")
+
+
+def test_slug_collisions_exhausted(client, monkeypatch):
+    monkeypatch.setattr(app, "new_slug", lambda: "pl-dup")
+    client.post("/accounts/100/payment-link")
+    with pytest.raises(IntegrityError):
+        client.post("/accounts/100/payment-link")
+
+
+def test_unknown_account(client):
+    assert client.post("/accounts/999/payment-link").status_code == 404